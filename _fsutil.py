@@ -0,0 +1,41 @@
+"""
+Filesystem helpers shared by the directory-listing, cleanup and file-generator scripts (stdlib only).
+"""
+
+import os
+from typing import Iterator
+
+
+def iter_files(directory) -> Iterator[os.DirEntry]:
+    """
+    Yield a DirEntry for every non-directory entry under `directory`, recursively.
+
+    Uses os.scandir so type checks come from the cached readdir data instead of
+    extra stat() calls. Like os.walk: symlinked directories are not followed and
+    unreadable directories are skipped.
+    """
+    stack = [directory]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue
+        subdirs = []
+        with it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if not is_dir:
+                    yield entry
+                elif not entry.is_symlink():
+                    subdirs.append(entry.path)
+        stack.extend(reversed(subdirs))
+
+
+def write_all(fd: int, data) -> None:
+    """os.write until all of data is written (os.write may write partially)."""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
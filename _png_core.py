@@ -0,0 +1,146 @@
+"""
+PNG building blocks shared by make_png_set.py, make_docx_all_visible_stdlib.py and
+make_target_sized_docx.py (stdlib only).
+
+Images are 8-bit RGB, filter 0, with the IDAT holding a zlib stream of stored (uncompressed)
+DEFLATE blocks, so the file size depends on the geometry only, never on the pixels.
+"""
+
+import binascii, ctypes, ctypes.util, functools, hashlib, struct, zlib
+
+PNG_SIG = b"\x89PNG\r\n\x1a\n"
+
+def _load_libdeflate(symbol: str):
+    """libdeflate checksum function (PCLMULQDQ/SIMD) via ctypes if the library is installed, else None."""
+    try:
+        name = ctypes.util.find_library("deflate")
+        if not name:
+            return None
+        fn = getattr(ctypes.CDLL(name), symbol)
+    except (OSError, AttributeError):
+        return None
+    fn.restype = ctypes.c_uint32
+    fn.argtypes = (ctypes.c_uint32, ctypes.c_void_p, ctypes.c_size_t)
+    return fn
+
+_libdeflate_crc32 = _load_libdeflate("libdeflate_crc32")
+_libdeflate_adler32 = _load_libdeflate("libdeflate_adler32")
+
+_LIBDEFLATE_MIN = 1024  # below this the ctypes call costs more than the faster checksum saves
+
+def _c_buffer(data):
+    """data as a ctypes argument without a copy: bytes as-is, writable buffers via from_buffer, else None."""
+    if type(data) is bytes:
+        return data
+    try:
+        return (ctypes.c_char * len(data)).from_buffer(data)
+    except TypeError:  # read-only buffer (e.g. a memoryview of bytes)
+        return None
+
+def fast_crc32(data, value: int = 0) -> int:
+    """CRC32 of data (continuing from value): libdeflate for large bytes/writable buffers, else binascii."""
+    if _libdeflate_crc32 is not None and len(data) >= _LIBDEFLATE_MIN:
+        buf = _c_buffer(data)
+        if buf is not None:
+            return _libdeflate_crc32(value, buf, len(data))
+    return binascii.crc32(data, value)
+
+def fast_adler32(data, value: int = 1) -> int:
+    """Adler32 of data (continuing from value) in one call: libdeflate like fast_crc32, else zlib.adler32."""
+    if _libdeflate_adler32 is not None and len(data) >= _LIBDEFLATE_MIN:
+        buf = _c_buffer(data)
+        if buf is not None:
+            return _libdeflate_adler32(value, buf, len(data))
+    return zlib.adler32(data, value)
+
+_pack_u32 = struct.Struct(">I").pack
+
+def make_chunker(typ: bytes):
+    """Chunk builder specialized for one chunk type: the CRC over typ is taken once, here."""
+    typ_crc = fast_crc32(typ)
+    def chunk(data: bytes) -> bytes:
+        # incremental CRC from the cached type state: no typ + data temporary
+        return b"".join((_pack_u32(len(data)), typ, data, _pack_u32(fast_crc32(data, typ_crc))))
+    return chunk
+
+_ihdr_chunk = make_chunker(b'IHDR')
+
+@functools.lru_cache(maxsize=32)
+def make_ihdr(width: int, height: int) -> bytes:
+    return _ihdr_chunk(struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))  # 8-bit RGB
+
+IEND_CHUNK = make_chunker(b'IEND')(b"")
+
+STORED_BLOCK = 65535  # max payload of one stored (uncompressed) DEFLATE block
+_FULL_BLOCK_HEADER = struct.pack("<BHH", 0, STORED_BLOCK, STORED_BLOCK ^ 0xFFFF)  # same for every non-final full block
+
+def make_idat(raw, prefix: bytes = b"", suffix: bytes = b"") -> bytearray:
+    """
+    Complete IDAT chunk holding raw scanlines as a zlib stream of stored DEFLATE blocks,
+    written into one preallocated buffer between prefix and suffix (e.g. signature + IHDR
+    and IEND), so no final join copies the image again.
+    One pass: each block is copied into place and the PNG CRC32 is updated over the copy while
+    it is cache-hot (no zlib.compress, no separate CRC pass over the result). The zlib Adler32
+    only covers raw, so it is taken in a single fast_adler32 call up front.
+    """
+    n = len(raw)
+    n_blocks = -(-n // STORED_BLOCK)
+    idat_len = 2 + 5 * n_blocks + n + 4
+    start = len(prefix)
+    out = bytearray(start + 4 + 4 + idat_len + 4 + len(suffix))
+    out[:start] = prefix
+    out[start:start + 10] = struct.pack(">I", idat_len) + b"IDAT\x78\x01"
+    adler = fast_adler32(raw)
+    view, out_view = memoryview(raw), memoryview(out)
+    crc = binascii.crc32(out_view[start + 4:start + 10])
+    pos = start + 10
+    for off in range(0, n, STORED_BLOCK):
+        block = view[off:off + STORED_BLOCK]
+        if off + STORED_BLOCK < n:
+            hdr = _FULL_BLOCK_HEADER
+        else:
+            hdr = struct.pack("<BHH", 1, len(block), len(block) ^ 0xFFFF)
+        end = pos + 5 + len(block)
+        out[pos:pos + 5] = hdr
+        out[pos + 5:end] = block
+        crc = fast_crc32(out_view[pos:end], crc)  # header + block, from the writable output buffer
+        pos = end
+    out_view.release()
+    trailer = struct.pack(">I", adler)
+    out[pos:pos + 4] = trailer
+    out[pos + 4:pos + 8] = struct.pack(">I", binascii.crc32(trailer, crc))
+    out[pos + 8:] = suffix
+    return out
+
+def random_bytes(seed: int, n: int) -> bytes:
+    """
+    n pseudo-random bytes determined by seed. SHAKE128 squeezes output in C at roughly twice
+    the rate of random.Random.randbytes (which goes through one huge int); pixels only need to
+    look random and differ per seed, not be secret.
+    """
+    return hashlib.shake_128(seed.to_bytes(8, "little")).digest(n)
+
+def random_raw(width_px: int, height_px: int, seed: int) -> bytearray:
+    """PNG raw scanlines: filter byte 0 + 3*width random RGB bytes per row."""
+    row_len = 1 + 3 * width_px
+    raw = bytearray(random_bytes(seed, row_len * height_px))  # one C-level fill for all pixels
+    raw[0::row_len] = bytes(height_px)  # filter type 0 at the start of every row
+    return raw
+
+def png_size_for_height(width_px: int, height_px: int) -> int:
+    """Exact size of a PNG built with make_idat: stored DEFLATE makes it depend on geometry only."""
+    raw_len = (1 + 3 * width_px) * height_px
+    n_blocks = -(-raw_len // STORED_BLOCK)
+    # signature + IHDR chunk + IEND chunk + IDAT chunk framing + zlib header/Adler32
+    return 8 + 25 + 12 + 12 + 2 + 5 * n_blocks + raw_len + 4
+
+def choose_png_height_for_size(per_image_target: int, width_px: int) -> tuple[int, int]:
+    """Smallest height whose PNG is >= per_image_target bytes; returns (height, png_size)."""
+    row_bytes = 1 + 3 * width_px
+    # Lower bound: count stored-block headers at their worst-case rate, then step up (<= 2 steps)
+    height_px = max(1, int((per_image_target - 63 - 5) / (row_bytes * (1 + 5 / STORED_BLOCK))))
+    while height_px > 1 and png_size_for_height(width_px, height_px - 1) >= per_image_target:
+        height_px -= 1
+    while png_size_for_height(width_px, height_px) < per_image_target:
+        height_px += 1
+    return height_px, png_size_for_height(width_px, height_px)
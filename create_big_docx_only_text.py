@@ -13,6 +13,7 @@ import os
 import random
 import string
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 
 # ----------------- Minimal OOXML parts -----------------
 CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8"?>
@@ -51,9 +52,21 @@ DOC_TAIL = """    <w:sectPr>
 PARA_PREFIX = b'    <w:p><w:r><w:t xml:space="preserve">'
 PARA_SUFFIX = b'</w:t></w:r></w:p>\n'
 PARA_OVERHEAD = len(PARA_PREFIX) + len(PARA_SUFFIX)
+PARA_SEPARATOR = PARA_SUFFIX + PARA_PREFIX
 
 ALPHA = string.ascii_lowercase  # safe for XML (no escaping)
-SPACES = [" ", "  ", "   ", " ", "\t", " ", "    "]  # varied whitespace; xml:space="preserve" keeps them
+# Random byte -> text byte lookup for bytes.translate: 208 of 256 values map to letters,
+# the rest to varied whitespace (xml:space="preserve" keeps them), ~1 in 5 chars is a break.
+TEXT_TABLE = (ALPHA * 8 + " " * 44 + "\t" * 3 + "\n").encode("ascii")
+RESERVOIR_BYTES = 16 * 1024 * 1024  # random text generated once, paragraphs slice into it
+
+# ZIP framing sizes (APPNOTE 4.3): local header, central directory entry, end record,
+# ZIP64 extra field (sizes only), ZIP64 end record + locator
+ZIP_LOCAL_HEADER = 30
+ZIP_CENTRAL_HEADER = 46
+ZIP_END_RECORD = 22
+ZIP64_EXTRA = 20
+ZIP64_END_RECORDS = 56 + 20
 
 # ----------------- Helpers -----------------
 def to_bytes(value: float, unit: str) -> int:
@@ -62,55 +75,47 @@ def to_bytes(value: float, unit: str) -> int:
     if u == "mb":  return int(value * 1_000_000)
     return int(value * 1_000_000_000)  # decimal GB
 
-def make_word(rng: random.Random, min_len=3, max_len=12) -> str:
-    n = rng.randint(min_len, max_len)
-    return "".join(rng.choice(ALPHA) for _ in range(n))
+def zip_entry_overhead(name: str, zip64_local: bool = False, zip64_central: bool = False) -> int:
+    """Bytes a ZIP_STORED entry adds on top of its data: local header + central directory entry."""
+    n = len(name.encode("utf-8"))
+    return (ZIP_LOCAL_HEADER + n + (ZIP64_EXTRA if zip64_local else 0) +
+            ZIP_CENTRAL_HEADER + n + (ZIP64_EXTRA if zip64_central else 0))
 
 def make_random_text(rng: random.Random, target_len: int) -> bytes:
     """
-    Build ~target_len chars of random words & spaces (ASCII only).
-    We slightly overshoot and then trim to exact byte length.
+    Build exactly target_len chars of random words & spaces (ASCII only).
+    One C-level randbytes fill mapped through TEXT_TABLE; no per-char Python work.
     """
-    parts = []
-    total = 0
-    # Build in chunks to reduce Python overhead
-    while total < target_len:
-        # One sentence-ish burst
-        burst = []
-        words = rng.randint(8, 18)
-        for _ in range(words):
-            burst.append(make_word(rng))
-            burst.append(rng.choice(SPACES))
-        burst.append("\n")  # occasional newline inside the text node
-        s = "".join(burst)
-        parts.append(s)
-        total += len(s)
-    text = "".join(parts)
-    if len(text) > target_len:
-        text = text[:target_len]
-    return text.encode("ascii", "strict")
-
-def build_paragraph_chunk(rng: random.Random, target_bytes: int, para_text_bytes: int) -> bytes:
+    return rng.randbytes(target_len).translate(TEXT_TABLE)
+
+def take_random_text(rng: random.Random, reservoir: memoryview, target_len: int) -> memoryview:
+    """Return target_len bytes of random text as a zero-copy slice of reservoir at a random offset."""
+    off = rng.randrange(len(reservoir) - target_len + 1)
+    return reservoir[off:off + target_len]
+
+def build_paragraph_chunk(rng: random.Random, reservoir: memoryview,
+                          target_bytes: int, para_text_bytes: int) -> bytes:
     """
     Build a chunk consisting of many <w:p> paragraphs whose total size ~= target_bytes.
-    Each paragraph contains xml:space='preserve' text of length 'para_text_bytes'.
+    Each paragraph contains xml:space='preserve' text of length 'para_text_bytes',
+    sliced from 'reservoir' (see take_random_text).
     """
     if para_text_bytes < 32:
         para_text_bytes = 32
-    chunk = bytearray()
-    # Write full paragraphs until close to target
-    while len(chunk) + PARA_OVERHEAD + para_text_bytes <= target_bytes:
-        chunk += PARA_PREFIX
-        chunk += make_random_text(rng, para_text_bytes)
-        chunk += PARA_SUFFIX
-    # Fit one last paragraph if we still have some room left
-    remaining = target_bytes - len(chunk)
+    # Full paragraphs that fit, then one last shorter paragraph if there is room left
+    n_paras = target_bytes // (PARA_OVERHEAD + para_text_bytes)
+    payloads = [take_random_text(rng, reservoir, para_text_bytes) for _ in range(n_paras)]
+    remaining = target_bytes - n_paras * (PARA_OVERHEAD + para_text_bytes)
     if remaining > PARA_OVERHEAD + 8:  # leave some minimum room for text
-        n_text = remaining - PARA_OVERHEAD
-        chunk += PARA_PREFIX
-        chunk += make_random_text(rng, n_text)
-        chunk += PARA_SUFFIX
-    return bytes(chunk)
+        payloads.append(take_random_text(rng, reservoir, remaining - PARA_OVERHEAD))
+    if not payloads:
+        return b""
+    # One join over prefix/text/separator/.../suffix: a single allocation, no extra copies
+    parts = [PARA_SEPARATOR] * (2 * len(payloads) + 1)
+    parts[0] = PARA_PREFIX
+    parts[1::2] = payloads
+    parts[-1] = PARA_SUFFIX
+    return b"".join(parts)
 
 def write_document_xml_stream(zf: zipfile.ZipFile,
                               entry_name: str,
@@ -123,12 +128,15 @@ def write_document_xml_stream(zf: zipfile.ZipFile,
     Stream word/document.xml so overall .docx ends up near total_target_bytes.
     """
     rng = random.Random(seed)
+    # Generate random text once; every paragraph is a slice of it at a random offset
+    reservoir = memoryview(make_random_text(rng, max(RESERVOIR_BYTES, para_text_bytes)))
 
     # Budget for document.xml (we store entries as ZIP_STORED, so sizes add)
     budget_docxml = max(0, total_target_bytes - other_parts_bytes)
 
     zi = zipfile.ZipInfo(entry_name)
     zi.compress_type = zipfile.ZIP_STORED
+    zi.create_system = 0  # same header bytes regardless of the host OS
     with zf.open(zi, mode="w", force_zip64=True) as w:
         # head
         w.write(DOC_HEAD)
@@ -137,17 +145,24 @@ def write_document_xml_stream(zf: zipfile.ZipFile,
         # how much space left inside document.xml (including tail)
         remaining = max(0, budget_docxml - written - len(DOC_TAIL))
 
-        # prebuild a randomized chunk ~chunk_bytes
-        # to keep randomness across loops, rebuild every so often
-        while remaining > 0:
-            target_chunk = min(chunk_bytes, remaining)
-            # Keep a tiny slack so metadata doesn't risk overflow
-            if target_chunk <= PARA_OVERHEAD + 16:
-                break
-            chunk = build_paragraph_chunk(rng, target_chunk, para_text_bytes)
-            w.write(chunk)
-            written += len(chunk)
-            remaining -= len(chunk)
+        # Build the next chunk while a single writer thread CRCs and writes the previous one
+        # (zlib.crc32 and file writes release the GIL on large buffers); order is preserved
+        # because at most one write is in flight.
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            pending = None
+            while remaining > 0:
+                target_chunk = min(chunk_bytes, remaining)
+                # Keep a tiny slack so metadata doesn't risk overflow
+                if target_chunk <= PARA_OVERHEAD + 16:
+                    break
+                chunk = build_paragraph_chunk(rng, reservoir, target_chunk, para_text_bytes)
+                if pending is not None:
+                    pending.result()
+                pending = writer.submit(w.write, chunk)
+                written += len(chunk)
+                remaining -= len(chunk)
+            if pending is not None:
+                pending.result()
 
         # tail
         w.write(DOC_TAIL)
@@ -169,9 +184,14 @@ def make_text_only_docx_random(out_path: str,
     # aim just below target
     effective_target = max(1, target_bytes - max(0, margin_bytes))
 
-    # sizes of fixed parts
-    other_parts_bytes = (len(CONTENT_TYPES.encode("utf-8")) +
-                         len(RELS_ROOT.encode("utf-8")))
+    # sizes of fixed parts, including their ZIP framing, plus document.xml's framing
+    # (force_zip64 local header; ZIP64 central extra + end records once past ZIP64_LIMIT)
+    large = effective_target > zipfile.ZIP64_LIMIT
+    other_parts_bytes = sum(len(data.encode("utf-8")) + zip_entry_overhead(name)
+                            for name, data in (("[Content_Types].xml", CONTENT_TYPES),
+                                               ("_rels/.rels", RELS_ROOT)))
+    other_parts_bytes += zip_entry_overhead("word/document.xml", zip64_local=True, zip64_central=large)
+    other_parts_bytes += ZIP_END_RECORD + (ZIP64_END_RECORDS if large else 0)
 
     with zipfile.ZipFile(out_path, "w", allowZip64=True) as zf:
         zf.writestr("[Content_Types].xml", CONTENT_TYPES, compress_type=zipfile.ZIP_STORED)
@@ -1,25 +1,28 @@
-import random
+import os
 import string
 import sys
 
+CHARS = string.ascii_letters + string.digits + ".,<>/?;\'\\:\"|[]{}=+-_!@#$%^&*(), "
+# 128-entry lookup (alphabet repeated to fill it), doubled to 256 so translate() does the `& 0x7F`
+_LUT = (CHARS * (128 // len(CHARS) + 1))[:128].encode('ascii') * 2
+
 def create_big_text_file(filename, size, unit='GB'):
     units = {'B': 1, 'KB': 1024, 'MB': 1024**2, 'GB': 1024**3}
     size_bytes = int(size * units.get(unit.upper(), units['GB']))
-    chars = string.ascii_letters + string.digits + ".,<>/?;\'\\:\"|[]{}=+-_!@#$%^&*(), "
     line_length = 75
-    batch_size = 100
+    lines_per_block = 1024 * 1024 // (line_length + 1)  # ~1 MB of text per write
+    total_lines = -(-size_bytes // (line_length + 1))
+
+    newlines = b'\n' * lines_per_block
 
-    with open(filename, 'w', encoding='utf-8') as f:
-        written = 0
-        while written < size_bytes:
-            lines = []
-            for _ in range(batch_size):
-                line = ''.join(random.choices(chars, k=line_length)) + '\n'
-                lines.append(line)
-                written += len(line)
-                if written >= size_bytes:
-                    break
-            f.writelines(lines)
+    with open(filename, 'wb', buffering=1024 * 1024) as f:
+        while total_lines > 0:
+            lines = min(lines_per_block, total_lines)
+            # Random bytes mapped through the lookup table, then a newline in every line's last column
+            block = bytearray(os.urandom(lines * (line_length + 1)).translate(_LUT))
+            block[line_length::line_length + 1] = newlines[:lines]
+            f.write(block)
+            total_lines -= lines
 
 if __name__ == '__main__':
     import argparse
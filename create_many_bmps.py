@@ -4,57 +4,54 @@ import random
 import struct
 import argparse
 import time
+from multiprocessing import Pool
+
+from _fsutil import write_all
 
 # ---------------- BMP GENERATOR (24-bit uncompressed) ---------------- #
 
-def make_bmp(width: int, height: int, seed: int) -> bytes:
-    """Return bytes of a valid 24-bit BMP image with random RGB pixels."""
-    random.seed(seed)
+WRITE_CHUNK_BYTES = 4 * 1024 * 1024
+
+def write_bmp(path: str, width: int, height: int, seed: int) -> int:
+    """Write a valid 24-bit BMP image with random RGB pixels to path; return bytes written.
 
+    Pixel rows are generated and written in ~4 MB blocks, so memory stays bounded
+    regardless of image size.
+    """
     # Each row padded to 4 bytes
     row_bytes = (width * 3 + 3) & ~3
     pixel_data_size = row_bytes * height
     file_size = 54 + pixel_data_size
 
-    # BITMAPFILEHEADER (14 bytes)
-    bfType = b'BM'
-    bfSize = struct.pack("<I", file_size)
-    bfReserved = b"\x00\x00\x00\x00"
-    bfOffBits = struct.pack("<I", 54)
-
-    # BITMAPINFOHEADER (40 bytes)
-    biSize = struct.pack("<I", 40)
-    biWidth = struct.pack("<i", width)
-    biHeight = struct.pack("<i", height)
-    biPlanes = struct.pack("<H", 1)
-    biBitCount = struct.pack("<H", 24)
-    biCompression = struct.pack("<I", 0)
-    biSizeImage = struct.pack("<I", pixel_data_size)
-    biXPelsPerMeter = struct.pack("<i", 2835)
-    biYPelsPerMeter = struct.pack("<i", 2835)
-    biClrUsed = struct.pack("<I", 0)
-    biClrImportant = struct.pack("<I", 0)
-
-    header = (
-        bfType + bfSize + bfReserved + bfOffBits +
-        biSize + biWidth + biHeight + biPlanes + biBitCount +
-        biCompression + biSizeImage + biXPelsPerMeter +
-        biYPelsPerMeter + biClrUsed + biClrImportant
+    # BITMAPFILEHEADER (14 bytes) + BITMAPINFOHEADER (40 bytes) in one pack:
+    # type, file size, reserved, pixel offset | header size, width, height, planes, bpp,
+    # compression, image size, x/y pixels-per-meter, colors used, colors important
+    header = struct.pack(
+        "<2sIHHIIiiHHIIiiII",
+        b'BM', file_size, 0, 0, 54,
+        40, width, height, 1, 24, 0, pixel_data_size, 2835, 2835, 0, 0,
     )
 
-    # Pixel data (BGR per pixel, rows bottom→top)
-    row = bytearray(row_bytes)
-    pixels = bytearray(pixel_data_size)
-    for y in range(height):
-        for x in range(width):
-            base = x * 3
-            row[base:base+3] = bytes([random.randrange(256), random.randrange(256), random.randrange(256)])
-        # pad row
-        row[width*3:row_bytes] = b'\x00' * (row_bytes - width*3)
-        start = y * row_bytes
-        pixels[start:start + row_bytes] = row
-
-    return header + pixels
+    # Pixel data (BGR per pixel, rows bottom→top), streamed in blocks of whole rows
+    rng = random.Random(seed)
+    rows_per_block = max(1, WRITE_CHUNK_BYTES // row_bytes)
+    # Unbuffered fd: every write is a large block, so the buffered-IO layer only adds copies
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        write_all(fd, header)
+        for y in range(0, height, rows_per_block):
+            rows = min(rows_per_block, height - y)
+            # one bulk fill, then zero the row padding
+            block = rng.randbytes(rows * row_bytes)
+            if row_bytes != width * 3:
+                block = bytearray(block)
+                for k in range(width * 3, row_bytes):
+                    block[k::row_bytes] = bytes(rows)
+            write_all(fd, block)
+    finally:
+        os.close(fd)
+
+    return file_size
 
 # ---------------- UTILITIES ---------------- #
 
@@ -70,6 +67,18 @@ def to_bytes(size_value: float, unit: str) -> int:
         return int(size_value * (1024 ** 2))
     return int(size_value)
 
+# ---------------- WORKERS ---------------- #
+
+_job = {}
+
+def _init_worker(out_dir: str, side: int, seed_offset: int) -> None:
+    """Pool initializer: keep per-run settings in the worker so tasks only pickle an index."""
+    _job.update(out_dir=out_dir, side=side, seed_offset=seed_offset)
+
+def _gen(i: int) -> int:
+    bmp_path = os.path.join(_job["out_dir"], f"random_{i+1:05d}.bmp")
+    return write_bmp(bmp_path, _job["side"], _job["side"], seed=i + _job["seed_offset"])
+
 # ---------------- MAIN ---------------- #
 
 def main():
@@ -79,6 +88,7 @@ def main():
     ap.add_argument("--target-size", type=float, required=True, help="Target total size (e.g. 4.0)")
     ap.add_argument("--unit", choices=["B", "MB", "MiB", "GB", "GiB"], default="MB", help="Unit for target size.")
     ap.add_argument("--unique-lines", type=int, default=10, help="How many scanlines per image to randomize uniquely.")
+    ap.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Worker processes (default: CPU count).")
     args = ap.parse_args()
 
     os.makedirs(args.out_dir, exist_ok=True)
@@ -94,13 +104,11 @@ def main():
     print(f"[INFO] Each ~{per_image_target/1_000_000:.2f} MB, dimension ~{side}x{side}px")
 
     start_time = time.time()
-    for i in range(args.count):
-        bmp_path = os.path.join(args.out_dir, f"random_{i+1:05d}.bmp")
-        bmp_bytes = make_bmp(side, side, seed=i + args.unique_lines)
-        with open(bmp_path, "wb") as f:
-            f.write(bmp_bytes)
-        if (i + 1) % max(1, args.count // 10) == 0:
-            print(f"  → {i+1}/{args.count} done")
+    init_args = (args.out_dir, side, args.unique_lines)
+    with Pool(max(1, args.jobs), initializer=_init_worker, initargs=init_args) as pool:
+        for done, _ in enumerate(pool.imap_unordered(_gen, range(args.count), chunksize=8), start=1):
+            if done % max(1, args.count // 10) == 0:
+                print(f"  → {done}/{args.count} done")
 
     elapsed = time.time() - start_time
     print(f"[DONE] Created {args.count} BMPs in {elapsed:.1f}s (total ~{args.target_size} {args.unit})")
@@ -24,14 +24,20 @@ def make_text_file(path: Path, content: str = "Sample text content") -> None:
     path.write_text(content, encoding="utf-8")
 
 def zip_directory(directory: Path) -> Path:
-    """Create a ZIP archive for the given directory and return the ZIP file path."""
+    """
+    Create a ZIP archive for the given directory and return the ZIP file path.
+
+    Nested .zip files are already compressed, so they are stored as-is instead of
+    being deflated again; everything else is deflated.
+    """
     zip_path = directory.with_suffix(".zip")
     with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
         for root, _, files in os.walk(directory):
             for file in files:
                 full_path = Path(root) / file
                 arcname = full_path.relative_to(directory)
-                zf.write(full_path, arcname)
+                compress_type = zipfile.ZIP_STORED if full_path.suffix.lower() == ".zip" else None
+                zf.write(full_path, arcname, compress_type=compress_type)
     return zip_path
 
 def build_nested_archives(base_dir: Path, depth: int) -> None:
@@ -3,10 +3,10 @@
 Delete a specific file from all subfolders under a root directory.
 
 Features:
-- Walks recursively with os.walk
+- Walks recursively with os.scandir (cached entry types, fewer stat calls)
 - Deletes matching files
 - Logs actions
-- Confirmation prompt before deletion
+- Confirmation prompt before deletion (--yes deletes in a single streaming pass)
 """
 
 import os
@@ -14,6 +14,8 @@ import argparse
 import logging
 from pathlib import Path
 
+from _fsutil import iter_files
+
 
 # --- Logging setup ---
 logging.basicConfig(
@@ -22,6 +24,34 @@ logging.basicConfig(
 )
 
 
+def delete_streaming(root_folder: Path, target_filename: str) -> int:
+    """
+    Delete all occurrences of target_filename inside root_folder in a single pass.
+
+    Files are unlinked as the walk finds them, so no candidate list is built.
+
+    Args:
+        root_folder: Base folder to scan
+        target_filename: File name to delete
+
+    Returns:
+        int: Number of deleted files
+    """
+    deleted_count = 0
+
+    for entry in iter_files(root_folder):
+        if entry.name == target_filename:
+            try:
+                os.unlink(entry.path)
+                logging.info("Deleted %s", entry.path)
+                deleted_count += 1
+            except Exception as e:
+                logging.error("Failed to delete %s: %s", entry.path, e)
+
+    logging.info("Done. Deleted %d file(s) named '%s'", deleted_count, target_filename)
+    return deleted_count
+
+
 def delete_file_from_subfolders(root_folder: Path, target_filename: str, confirm: bool = True) -> int:
     """
     Delete all occurrences of target_filename inside root_folder recursively.
@@ -34,14 +64,15 @@ def delete_file_from_subfolders(root_folder: Path, target_filename: str, confirm
     Returns:
         int: Number of deleted files
     """
+    if not confirm:
+        return delete_streaming(root_folder, target_filename)
+
     deleted_count = 0
     candidates = []
 
-    for foldername, _, filenames in os.walk(root_folder):
-        for filename in filenames:
-            if filename == target_filename:
-                file_path = Path(foldername) / filename
-                candidates.append(file_path)
+    for entry in iter_files(root_folder):
+        if entry.name == target_filename:
+            candidates.append(Path(entry.path))
 
     if not candidates:
         logging.info("No files named %s found under %s", target_filename, root_folder)
@@ -49,11 +80,10 @@ def delete_file_from_subfolders(root_folder: Path, target_filename: str, confirm
 
     logging.info("Found %d files named %s under %s", len(candidates), target_filename, root_folder)
 
-    if confirm:
-        answer = input(f"Do you really want to delete {len(candidates)} file(s) named '{target_filename}'? [y/N]: ")
-        if answer.lower() not in ("y", "yes"):
-            logging.info("Deletion cancelled.")
-            return 0
+    answer = input(f"Do you really want to delete {len(candidates)} file(s) named '{target_filename}'? [y/N]: ")
+    if answer.lower() not in ("y", "yes"):
+        logging.info("Deletion cancelled.")
+        return 0
 
     for file_path in candidates:
         try:
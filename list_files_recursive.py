@@ -3,25 +3,28 @@
 List files in a directory tree and save their relative paths.
 
 Features:
-- Walks a directory recursively
+- Walks a directory recursively (os.scandir, cached entry types)
 - Writes relative paths into an output file (UTF-8)
 - Optional filtering (prefix/suffix/substring)
 - Output filename automatically prefixed with timestamp
 """
 
-import os
 import logging
 import argparse
 from datetime import datetime
 from pathlib import Path
 from typing import Optional
 
+from _fsutil import iter_files
+
 # --- Logging setup ---
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s [%(levelname)s] %(message)s"
 )
 
+WRITE_BATCH = 10_000  # paths joined per write call
+
 
 def list_files_recursive(
     directory: Path,
@@ -44,24 +47,32 @@ def list_files_recursive(
         int: number of files written
     """
     count = 0
-    with output_file.open("w", encoding="utf-8") as f:
-        for root, _, files in os.walk(directory):
-            for file in files:
-                full_path = Path(root) / file
-                if root_prefix:
-                    relative_path = full_path.relative_to(root_prefix)
-                else:
-                    relative_path = full_path.relative_to(directory)
-
-                rel_str = str(relative_path).replace("\\", "/")
-
-                if startswith and not rel_str.startswith(startswith):
-                    continue
-                if contains and contains not in rel_str:
-                    continue
-
-                f.write(rel_str + "\n")
-                count += 1
+    batch = []
+    with output_file.open("w", encoding="utf-8", buffering=1024 * 1024) as f:
+        for entry in iter_files(directory):
+            full_path = Path(entry.path)
+            if root_prefix:
+                relative_path = full_path.relative_to(root_prefix)
+            else:
+                relative_path = full_path.relative_to(directory)
+
+            rel_str = str(relative_path).replace("\\", "/")
+
+            if startswith and not rel_str.startswith(startswith):
+                continue
+            if contains and contains not in rel_str:
+                continue
+
+            batch.append(rel_str)
+            count += 1
+            if len(batch) >= WRITE_BATCH:
+                f.write("\n".join(batch))
+                f.write("\n")
+                batch.clear()
+
+        if batch:
+            f.write("\n".join(batch))
+            f.write("\n")
 
     logging.info("Wrote %d file paths to %s", count, output_file)
     return count
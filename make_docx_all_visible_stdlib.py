@@ -1,43 +1,101 @@
 #!/usr/bin/env python3
-import argparse, os, random, struct, zlib, zipfile, time
-
-PNG_SIG = b"\x89PNG\r\n\x1a\n"
-
-def _crc32(data: bytes) -> int:
-    import binascii
-    return binascii.crc32(data) & 0xFFFFFFFF
-
-def _chunk(typ: bytes, data: bytes) -> bytes:
-    return struct.pack(">I", len(data)) + typ + data + struct.pack(">I", _crc32(typ + data))
-
-def build_png_bytes(width_px: int, height_px: int, seed: int) -> bytes:
-    rng = random.Random(seed)
-    ihdr = struct.pack(">IIBBBBB", width_px, height_px, 8, 2, 0, 0, 0)  # 8-bit RGB
-    row_len = 1 + 3 * width_px
-    raw = bytearray(row_len * height_px)
-    p = 0
-    for _ in range(height_px):
-        raw[p] = 0  # filter type 0
-        p += 1
-        for _ in range(width_px * 3):
-            raw[p] = rng.randrange(0, 256)
-            p += 1
-    idat = zlib.compress(bytes(raw), level=0)  # predictable
-    return b"".join([PNG_SIG, _chunk(b'IHDR', ihdr), _chunk(b'IDAT', idat), _chunk(b'IEND', b"")])
-
-def choose_png_height_for_size(per_image_target: int, width_px: int) -> tuple[int, bytes]:
-    base_overhead = 100
-    row_bytes = 1 + 3 * width_px
-    height_px = max(1, (per_image_target - base_overhead) // row_bytes)
-    seed = 1234
-    png = build_png_bytes(width_px, height_px, seed)
-    attempts = 0
-    while len(png) < per_image_target and attempts < 100000:
-        height_px += 1
-        seed += 1
-        png = build_png_bytes(width_px, height_px, seed)
-        attempts += 1
-    return height_px, png
+import argparse, binascii, os, re, struct, zlib, zipfile, time
+
+from _png_core import (IEND_CHUNK, PNG_SIG, STORED_BLOCK, choose_png_height_for_size, make_ihdr, make_idat,
+                       random_bytes, random_raw)
+
+def build_png_bytes(width_px: int, height_px: int, seed: int) -> bytearray:
+    raw = random_raw(width_px, height_px, seed)  # stored blocks: predictable size
+    return make_idat(raw, PNG_SIG + make_ihdr(width_px, height_px), IEND_CHUNK)
+
+def png_variant_factory(width_px: int, height_px: int, seed: int):
+    """
+    Build one PNG and return ((png_parts, file_crc), variant), where variant(seed) returns
+    (png_parts, file_crc) for a PNG of identical size whose last scanline holds fresh random
+    pixels. PNGs are lists of byte segments (concatenate or stream them) and file_crc is the
+    CRC32 of the whole file, as a ZIP entry needs; the segments share one IDAT buffer, so
+    write a PNG out before asking for the next variant.
+
+    The IDAT stream is built once; per variant only that row is patched in place and the
+    Adler32 trailer, IDAT CRC and file CRC recomputed -- no regeneration or recompression
+    of the whole image. The row sits at the end of the stream, so both CRCs only rehash the
+    bytes from the row onwards, continuing from the CRC state of the unchanged prefix.
+    """
+    raw = random_raw(width_px, height_px, seed)
+    idat_chunk = make_idat(raw)  # length + 'IDAT' + zlib stream + CRC, patched in place below
+    row_start = len(raw) - 3 * width_px  # pixels of the last row (after its filter byte)
+    adler_prefix = zlib.adler32(memoryview(raw)[:row_start])
+    # chunk offset of the row: length + type (8), zlib header (2), one 5-byte header per block so far
+    chunk_row_start = 8 + 2 + 5 * (row_start // STORED_BLOCK + 1) + row_start
+    crc_prefix = binascii.crc32(memoryview(idat_chunk)[4:chunk_row_start])
+    head, iend = PNG_SIG + make_ihdr(width_px, height_px), IEND_CHUNK
+    parts = [head, idat_chunk, iend]
+    file_crc_prefix = binascii.crc32(memoryview(idat_chunk)[:chunk_row_start], binascii.crc32(head))
+
+    def file_crc() -> int:
+        return binascii.crc32(iend, binascii.crc32(memoryview(idat_chunk)[chunk_row_start:], file_crc_prefix))
+
+    def variant(seed: int) -> tuple[list, int]:
+        row = random_bytes(seed, 3 * width_px)
+        # copy the row into the IDAT stream, stepping over stored-block headers
+        pos, src = row_start, 0
+        while src < len(row):
+            blk, in_blk = divmod(pos, STORED_BLOCK)
+            n = min(len(row) - src, STORED_BLOCK - in_blk)
+            dst = 8 + 2 + 5 * (blk + 1) + pos
+            idat_chunk[dst:dst + n] = row[src:src + n]
+            pos += n
+            src += n
+        idat_chunk[-8:-4] = struct.pack(">I", zlib.adler32(row, adler_prefix))
+        crc = binascii.crc32(memoryview(idat_chunk)[chunk_row_start:-4], crc_prefix)
+        idat_chunk[-4:] = struct.pack(">I", crc)
+        return parts, file_crc()
+
+    return (parts, file_crc()), variant
+
+OUTPUT_BUFFER = 16 * 1024 * 1024
+
+# --compression choices for media entries. Random-pixel PNGs do not compress, so stored is the
+# default; zipfile has no LZ4 method and Zstandard only from Python 3.14 on.
+MEDIA_COMPRESSION = {"stored": zipfile.ZIP_STORED, "deflate": zipfile.ZIP_DEFLATED}
+if hasattr(zipfile, "ZIP_ZSTANDARD"):
+    MEDIA_COMPRESSION["zstd"] = zipfile.ZIP_ZSTANDARD
+
+XML_COMPRESSLEVEL = 1  # XML parts are deflated: they are repetitive markup (document.xml ~100:1)
+
+def _deflated_len(text: str) -> int:
+    """Payload size of text as a ZIP_DEFLATED entry at XML_COMPRESSLEVEL (for the size budget)."""
+    c = zlib.compressobj(XML_COMPRESSLEVEL, zlib.DEFLATED, -15)
+    return len(c.compress(text.encode("utf-8"))) + len(c.flush())
+
+def _write_png_entry(zf: zipfile.ZipFile, name: str, parts: list, crc: int) -> None:
+    """
+    Write a PNG given as byte segments into a ZIP_STORED entry whose CRC32 is already known.
+    zf.open(..., "w") would rehash every byte; here the local header goes out with the final
+    CRC and sizes, then the segments are copied straight to the (seekable) archive file.
+    Mirrors ZipFile.open(..., "w")/_ZipWriteFile.close for a stored entry, including the guard
+    against an open write handle and the archive lock.
+    """
+    if zf._writing:
+        raise ValueError("Can't write to the ZIP file while there is another write handle open on it.")
+    zinfo = zipfile.ZipInfo(name)
+    zinfo.compress_type = zipfile.ZIP_STORED
+    zinfo.file_size = zinfo.compress_size = sum(map(len, parts))
+    zinfo.CRC = crc
+    zinfo.external_attr = 0o600 << 16  # same permissions zf.open(..., "w") gives
+    with zf._lock:
+        fp = zf.fp
+        if fp.tell() != zf.start_dir:  # BufferedWriter.seek always flushes; entries normally follow on
+            fp.seek(zf.start_dir)
+        zinfo.header_offset = zf.start_dir
+        zf._writecheck(zinfo)
+        zf._didModify = True
+        fp.write(zinfo.FileHeader(zinfo.file_size > zipfile.ZIP64_LIMIT))
+        for part in parts:
+            fp.write(part)
+        zf.start_dir = fp.tell()
+        zf.filelist.append(zinfo)
+        zf.NameToInfo[name] = zinfo
 
 def emu_from_cm(cm: float) -> int:
     return int((cm / 2.54) * 914400)
@@ -60,49 +118,32 @@ RELS_ROOT = """<?xml version="1.0" encoding="UTF-8"?>
 </Relationships>
 """.strip()
 
-def build_doc_rels(num_images: int) -> str:
-    parts = ["""<?xml version="1.0" encoding="UTF-8"?>
-<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
-"""]
-    for i in range(1, num_images + 1):
-        parts.append(f"""  <Relationship Id="rIdImg{i}"
+# Per-image XML fragments, formatted with % against a cached template (no per-iteration f-string)
+_REL_TEMPLATE = """  <Relationship Id="rIdImg%d"
                 Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/image"
-                Target="media/image{i:05d}.png"/>
-""")
-    parts.append("</Relationships>\n")
-    return "".join(parts)
-
-def build_document_xml(num_images: int, cx_emu: int, cy_emu: int) -> str:
-    head = f"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
-<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"
-            xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"
-            xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main"
-            xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture"
-            xmlns:wp="http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing">
-  <w:body>
-    <w:p><w:r><w:t>Generated document displaying {num_images} image(s).</w:t></w:r></w:p>
+                Target="media/image%05d.png"/>
 """
-    body = []
-    for i in range(1, num_images + 1):
-        body.append(f"""    <w:p>
+
+# placeholders: cx, cy, id, id, id, image number, rel number, cx, cy
+_IMG_P_TEMPLATE = """    <w:p>
       <w:r>
         <w:drawing>
           <wp:inline distT="0" distB="0" distL="0" distR="0">
-            <wp:extent cx="{cx_emu}" cy="{cy_emu}"/>
-            <wp:docPr id="{i}" name="Picture {i}"/>
+            <wp:extent cx="%d" cy="%d"/>
+            <wp:docPr id="%d" name="Picture %d"/>
             <a:graphic>
               <a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture">
                 <pic:pic>
                   <pic:nvPicPr>
-                    <pic:cNvPr id="{i}" name="image{i:05d}.png"/>
+                    <pic:cNvPr id="%d" name="image%05d.png"/>
                     <pic:cNvPicPr/>
                   </pic:nvPicPr>
                   <pic:blipFill>
-                    <a:blip r:embed="rIdImg{i}"/>
+                    <a:blip r:embed="rIdImg%d"/>
                     <a:stretch><a:fillRect/></a:stretch>
                   </pic:blipFill>
                   <pic:spPr>
-                    <a:xfrm><a:off x="0" y="0"/><a:ext cx="{cx_emu}" cy="{cy_emu}"/></a:xfrm>
+                    <a:xfrm><a:off x="0" y="0"/><a:ext cx="%d" cy="%d"/></a:xfrm>
                     <a:prstGeom prst="rect"><a:avLst/></a:prstGeom>
                   </pic:spPr>
                 </pic:pic>
@@ -112,7 +153,41 @@ def build_document_xml(num_images: int, cx_emu: int, cy_emu: int) -> str:
         </w:drawing>
       </w:r>
     </w:p>
-""")
+"""
+
+def build_doc_rels(num_images: int) -> str:
+    head = """<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+"""
+    body = "".join([_REL_TEMPLATE % (i, i) for i in range(1, num_images + 1)])
+    return head + body + "</Relationships>\n"
+
+def _compile_image_paragraphs(cx_emu: int, cy_emu: int):
+    """
+    Generate and compile emit(n) -> str returning the paragraphs for images 1..n.
+    cx/cy are the same for every image, so they are folded into the generated source as
+    literals; the compiled f-string then only formats the image number (5 holes instead of
+    9 %-substitutions per image).
+    """
+    holes = (cx_emu, cy_emu, "{i}", "{i}", "{i}", "{i:05d}", "{i}", cx_emu, cy_emu)
+    text = _IMG_P_TEMPLATE.replace("{", "{{").replace("}", "}}")
+    text = text.replace("%05d", "%s").replace("%d", "%s") % holes
+    src = "def emit(n):\n    return ''.join([f%r for i in range(1, n + 1)])\n" % text
+    ns = {}
+    exec(compile(src, "<document.xml emitter>", "exec"), ns)
+    return ns["emit"]
+
+def build_document_xml(num_images: int, cx_emu: int, cy_emu: int) -> str:
+    head = f"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+            xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+            xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main"
+            xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture"
+            xmlns:wp="http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing">
+  <w:body>
+    <w:p><w:r><w:t>Generated document displaying {num_images} image(s).</w:t></w:r></w:p>
+"""
+    body = _compile_image_paragraphs(cx_emu, cy_emu)(num_images)
     tail = """    <w:sectPr>
       <w:pgSz w:w="11907" w:h="16840"/>
       <w:pgMar w:top="1134" w:right="1134" w:bottom="1134" w:left="1134" w:header="708" w:footer="708" w:gutter="0"/>
@@ -120,7 +195,7 @@ def build_document_xml(num_images: int, cx_emu: int, cy_emu: int) -> str:
   </w:body>
 </w:document>
 """
-    return head + "".join(body) + tail
+    return head + body + tail
 
 def make_docx_all_visible(docx_path: str,
                   num_images: int,
@@ -128,11 +203,15 @@ def make_docx_all_visible(docx_path: str,
                   png_width_px: int = 512,
                   page_width_cm: float = 21.0,
                   left_margin_cm: float = 2.0,
-                  right_margin_cm: float = 2.0) -> dict:
+                  right_margin_cm: float = 2.0,
+                  unique: bool = False,
+                  compression: str = "stored") -> dict:
     if num_images < 1:
         raise ValueError("num_images must be >= 1")
     if png_width_px < 1:
         raise ValueError("png_width_px must be >= 1")
+    if compression not in MEDIA_COMPRESSION:
+        raise ValueError(f"compression must be one of {', '.join(MEDIA_COMPRESSION)}")
 
     # Compute display width (content width) in EMU
     content_width_cm = max(0.5, page_width_cm - left_margin_cm - right_margin_cm)
@@ -143,18 +222,14 @@ def make_docx_all_visible(docx_path: str,
     rels_xml = build_doc_rels(num_images)
     placeholder_doc_xml = build_document_xml(num_images, cx_emu, placeholder_cy)
 
-    base_fixed = (len(CONTENT_TYPES.encode("utf-8")) +
-                  len(RELS_ROOT.encode("utf-8")) +
-                  len(rels_xml.encode("utf-8")) +
-                  len(placeholder_doc_xml.encode("utf-8")))
+    base_fixed = sum(map(_deflated_len, (CONTENT_TYPES, RELS_ROOT, rels_xml, placeholder_doc_xml)))
 
     SAFETY_ZIP_OVERHEAD = 800_000  # a bit higher to avoid edge cases
     bytes_for_media = max(1, target_total_bytes - base_fixed - SAFETY_ZIP_OVERHEAD)
     per_image_target = max(1, bytes_for_media // num_images)
 
     # Choose PNG height to meet per-image target
-    png_height_px, sample_png = choose_png_height_for_size(per_image_target, png_width_px)
-    per_png_bytes = len(sample_png)
+    png_height_px, per_png_bytes = choose_png_height_for_size(per_image_target, png_width_px)
 
     # Now rebuild the document XML with the correct cy honoring aspect ratio
     cy_emu = max(1, int(cx_emu * (png_height_px / float(png_width_px))))
@@ -165,25 +240,36 @@ def make_docx_all_visible(docx_path: str,
     if ext.lower() != ".docx":
         docx_path = root + ".docx"
 
-    with zipfile.ZipFile(docx_path, "w", allowZip64=True) as zf:
-        zf.writestr("[Content_Types].xml", CONTENT_TYPES)
-        zf.writestr("_rels/.rels", RELS_ROOT)
-        zf.writestr("word/_rels/document.xml.rels", rels_xml)
-        zf.writestr("word/document.xml", document_xml)
+    # Large buffer: stored PNG entries are appended without a seek (_write_png_entry), so their
+    # local headers and small segments coalesce into few write syscalls. zipfile's own entries
+    # (writestr, zf.open) seek, and so flush, on every entry.
+    media_type = MEDIA_COMPRESSION[compression]
+    with open(docx_path, "wb", buffering=OUTPUT_BUFFER) as fp, \
+            zipfile.ZipFile(fp, "w", compression=media_type, compresslevel=1, allowZip64=True) as zf:
+        for name, xml in (("[Content_Types].xml", CONTENT_TYPES),
+                          ("_rels/.rels", RELS_ROOT),
+                          ("word/_rels/document.xml.rels", rels_xml),
+                          ("word/document.xml", document_xml)):
+            zf.writestr(name, xml, compress_type=zipfile.ZIP_DEFLATED, compresslevel=XML_COMPRESSLEVEL)
 
+        # One full PNG, stored for every image unless unique=True; then the others only
+        # re-randomize its last scanline (same size, cheap).
+        # Each PNG is streamed into its entry with its CRC precomputed, so no per-image bytes
+        # object is built and zipfile never rehashes the image data (compressed media go through
+        # zf.open instead, at the archive's compression and level 1).
+        zip64 = per_png_bytes * 1.05 > zipfile.ZIP64_LIMIT  # zipfile's own margin for growth
+        sample_png, png_variant = png_variant_factory(png_width_px, png_height_px, 10000)
         seed = 10000
         for i in range(1, num_images + 1):
-            if i == 1:
-                png_bytes = sample_png
-            else:
-                png_bytes = build_png_bytes(png_width_px, png_height_px, seed)
+            parts, crc = png_variant(seed) if unique and i > 1 else sample_png
             seed += 1
-            if len(png_bytes) != per_png_bytes:
-                png_bytes = sample_png
             name = f"word/media/image{i:05d}.png"
-            zinfo = zipfile.ZipInfo(name)
-            zinfo.compress_type = zipfile.ZIP_STORED
-            zf.writestr(zinfo, png_bytes)
+            if media_type == zipfile.ZIP_STORED:
+                _write_png_entry(zf, name, parts, crc)
+            else:
+                with zf.open(name, "w", force_zip64=zip64) as dest:
+                    for part in parts:
+                        dest.write(part)
 
     final_size = os.path.getsize(docx_path)
     return {
@@ -196,7 +282,15 @@ def make_docx_all_visible(docx_path: str,
     }
 
 # ----- Simple validator for the result -----
-def validate_docx(path: str) -> None:
+_REL_ID_RE = re.compile(rb'Relationship Id="([^"]+)"')
+_EMBED_RE = re.compile(rb'r:embed="([^"]+)"')
+
+def validate_docx(path: str, full: bool = False) -> None:
+    """
+    Check the generated package. document.xml comes from a fixed template, so by default it
+    only gets spot checks (prolog, body, closing tag, embed count); full=True also parses it,
+    streaming with iterparse so the tree is not kept in memory.
+    """
     import xml.etree.ElementTree as ET
     with zipfile.ZipFile(path, "r") as z:
         names = set(z.namelist())
@@ -204,20 +298,16 @@ def validate_docx(path: str) -> None:
             if req not in names:
                 print("❌ Missing part:", req); return
         # check relationships count and targets
-        drels = z.read("word/_rels/document.xml.rels").decode("utf-8","replace")
-        rel_ids = [line.split('Id="')[1].split('"',1)[0] for line in drels.splitlines() if 'Relationship Id=' in line]
-        # naive scan of r:embed in document.xml
-        doc_xml = z.read("word/document.xml").decode("utf-8","replace")
-        embeds = []
-        i = 0
-        while True:
-            j = doc_xml.find('r:embed="', i)
-            if j == -1: break
-            k = doc_xml.find('"', j+9)
-            embeds.append(doc_xml[j+9:k])
-            i = k+1
+        rel_ids = _REL_ID_RE.findall(z.read("word/_rels/document.xml.rels"))
+        # scan r:embed in document.xml (bytes, in re's C engine)
+        doc_xml = z.read("word/document.xml")
+        embeds = _EMBED_RE.findall(doc_xml)
         if len(embeds) != len(rel_ids):
             print(f"⚠️ Mismatch embeds vs rels: {len(embeds)} vs {len(rel_ids)}")
+        if not (doc_xml.startswith(b"<?xml") and doc_xml.rstrip().endswith(b"</w:document>")
+                and b"<w:body>" in doc_xml and b"</w:body>" in doc_xml):
+            print("❌ document.xml is truncated or malformed"); return
+        del doc_xml
         # try parsing XMLs
         try: ET.fromstring(z.read("[Content_Types].xml"))
         except Exception as e: print("❌ content types parse error:", e); return
@@ -225,7 +315,13 @@ def validate_docx(path: str) -> None:
         except Exception as e: print("❌ root rels parse error:", e); return
         try: ET.fromstring(z.read("word/_rels/document.xml.rels"))
         except Exception as e: print("❌ doc rels parse error:", e); return
-        try: ET.fromstring(z.read("word/document.xml"))
+        if not full:
+            print("✅ Basic structure & XML parse OK (document.xml spot-checked).")
+            return
+        try:
+            with z.open("word/document.xml") as f:
+                for _, elem in ET.iterparse(f, events=("end",)):
+                    elem.clear()
         except Exception as e: print("❌ document.xml parse error:", e); return
     print("✅ Basic structure & XML parse OK.")
 
@@ -244,6 +340,13 @@ def main():
     ap.add_argument("--page-width-cm", type=float, default=21.0, help="A4 width in cm")
     ap.add_argument("--margin-left-cm", type=float, default=2.0)
     ap.add_argument("--margin-right-cm", type=float, default=2.0)
+    ap.add_argument("--full-validate", action="store_true",
+                    help="Fully parse document.xml when validating (default: lightweight checks)")
+    ap.add_argument("--unique", action="store_true",
+                    help="Give every PNG its own pixels (default: one shared PNG, built once)")
+    ap.add_argument("--compression", choices=list(MEDIA_COMPRESSION), default="stored",
+                    help="ZIP method for PNG media (default: stored; random pixels do not compress). "
+                         "XML parts are always deflated at level 1")
     args = ap.parse_args()
 
     target_bytes = to_bytes(args.target_size, args.unit)
@@ -255,6 +358,8 @@ def main():
         page_width_cm=args.page_width_cm,
         left_margin_cm=args.margin_left_cm,
         right_margin_cm=args.margin_right_cm,
+        unique=args.unique,
+        compression=args.compression,
     )
 
     fb = info["final_bytes"]
@@ -271,7 +376,7 @@ def main():
     print(f"Duration: {duration:.2f} seconds ({duration/60:.2f} min, {duration/3600:.2f} hr)")
 
     # Optional quick validation
-    validate_docx(info['docx_path'])
+    validate_docx(info['docx_path'], full=args.full_validate)
 
 
 if __name__ == "__main__":
@@ -3,6 +3,7 @@
 Generate N PNG files totalling a target size, FAST, with controllable uniqueness.
 
 Uniqueness modes:
+  - identical: one PNG built once, every file a byte-identical copy (fastest)
   - metadata : same pixels, inject per-file tEXt chunk (different bytes only)
   - pixels   : per-file unique RGB row, repeated for image (visually different) [default]
   - strong   : K unique rows per image (tiled), more varied visuals
@@ -10,6 +11,10 @@ Uniqueness modes:
 Speed notes:
   - zlib level 0 + filter 0 keeps size linear and independent of content → identical size per file
   - No per-pixel Python loops; we build rows as bytes and repeat
+  - identical/metadata modes copy the shared bytes from a template file (copy_file_range, reflink-capable)
+  - files are written with os.open/os.write, no fsync
+  - --jobs defaults to the CPU count only for identical/metadata (pure writes); pixels/strong build a
+    whole PNG per thread, so more threads multiply peak memory by file size
 
 Examples:
   python make_png_set_fast_unique.py --outdir out --num-files 1000 --total-size 1 --unit GB
@@ -17,44 +22,36 @@ Examples:
   python make_png_set_fast_unique.py --outdir out --num-files 500 --total-size 0.5 --unit GB --mode strong --rows-unique 8
 """
 
-import argparse, os, struct, zlib, secrets
+import argparse, multiprocessing, os, random
 from concurrent.futures import ThreadPoolExecutor
 
-PNG_SIG = b"\x89PNG\r\n\x1a\n"
+from _fsutil import write_all
+from _png_core import IEND_CHUNK, PNG_SIG, choose_png_height_for_size, make_chunker, make_ihdr, make_idat
 
-def _crc32(data: bytes) -> int:
-    import binascii
-    return binascii.crc32(data) & 0xFFFFFFFF
+# Pixels only need to differ per file, not be unpredictable: a userspace PRNG seeded once
+# from the OS avoids a getrandom() syscall per row (randbytes is C-implemented, Python >= 3.9).
+_prng = random.Random(os.urandom(16))
 
-def _chunk(typ: bytes, data: bytes) -> bytes:
-    return struct.pack(">I", len(data)) + typ + data + struct.pack(">I", _crc32(typ + data))
-
-def _ihdr(width: int, height: int) -> bytes:
-    return _chunk(b'IHDR', struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))  # 8-bit RGB
-
-def _iend() -> bytes:
-    return _chunk(b'IEND', b"")
-
-def build_png_from_rows(width: int, rows_rgb: bytes, height: int) -> bytes:
+def build_png_from_rows(width: int, rows_rgb: bytes, height: int) -> bytearray:
     """
     rows_rgb: concatenation of PNG scanlines WITHOUT filter byte (3*width per line) for a base period.
-    We repeat that period to reach the requested height. Filter 0, zlib level 0.
+    We repeat that period to reach the requested height. Filter 0, stored (level 0) DEFLATE.
     """
     row_len = 3 * width
     assert len(rows_rgb) % row_len == 0
     period = len(rows_rgb) // row_len
-    # Build raw with filter byte 0 for each row
-    raw = bytearray((row_len + 1) * height)
-    # Fill by period to avoid Python loops per pixel
-    pos = 0
-    for r in range(height):
-        raw[pos] = 0
-        pos += 1
-        off = (r % period) * row_len
-        raw[pos:pos+row_len] = rows_rgb[off:off+row_len]
-        pos += row_len
-    idat = zlib.compress(bytes(raw), level=0)
-    return b"".join([PNG_SIG, _ihdr(width, height), _chunk(b'IDAT', idat), _iend()])
+    stride = row_len + 1
+    # One period of scanlines with their filter byte 0 (loop runs over the period, not the height)
+    tile = bytearray(period * stride)
+    for k in range(period):
+        tile[k*stride+1:(k+1)*stride] = rows_rgb[k*row_len:(k+1)*row_len]
+    # Repeat the period in C (sequence repetition is a memcpy), then the partial last period
+    full, rest = divmod(height, period)
+    raw = tile * full
+    raw += tile[:rest * stride]
+    return make_idat(raw, PNG_SIG + make_ihdr(width, height), IEND_CHUNK)
+
+_text_chunk = make_chunker(b"tEXt")
 
 def fixed_len_text_chunk(tag: str, content_bytes: bytes, fixed_len: int) -> bytes:
     if len(content_bytes) < fixed_len:
@@ -62,30 +59,77 @@ def fixed_len_text_chunk(tag: str, content_bytes: bytes, fixed_len: int) -> byte
     elif len(content_bytes) > fixed_len:
         content_bytes = content_bytes[:fixed_len]
     data = tag.encode("latin-1") + b"\x00" + content_bytes
-    return _chunk(b"tEXt", data)
+    return _text_chunk(data)
 
 def insert_chunk_before_iend(png_bytes: bytes, chunk: bytes) -> bytes:
     # Replace final IEND with chunk + IEND
     return png_bytes[:-12] + chunk + png_bytes[-12:]
 
-def pick_geometry_for_target(per_file_target: int, width: int, rows_in_period: int) -> tuple[int, bytes]:
+def pick_geometry_for_target(per_file_target: int, width: int, rows_in_period: int) -> tuple[int, bytes, bytearray]:
     """
     Choose a height so that a PNG built from 'rows_in_period' unique rows meets per_file_target.
-    We start with a reasonable estimate and grow.
+    Stored DEFLATE makes the size a function of the geometry alone, so the height is solved
+    directly and the PNG built once. Returns (height, period, png).
     """
     row_len = 3 * width
     # Make a random period (rows_in_period rows)
-    period = b"".join(secrets.token_bytes(row_len) for _ in range(rows_in_period))
-    # Estimate: each row contributes (row_len + 1) raw bytes, plus small zlib overhead
-    base_overhead = 150
-    row_stride = row_len + 1
-    height = max(rows_in_period, (per_file_target - base_overhead) // row_stride)
-    png = build_png_from_rows(width, period, height)
-    # grow until >= target
-    while len(png) < per_file_target:
-        height += 1
-        png = build_png_from_rows(width, period, height)
-    return height, period, png
+    period = _prng.randbytes(rows_in_period * row_len)
+    height, _ = choose_png_height_for_size(per_file_target, width)
+    height = max(rows_in_period, height)
+    return height, period, build_png_from_rows(width, period, height)
+
+def _writev_all(fd: int, parts: list) -> None:
+    """
+    Write the segments in order with os.writev: normally one syscall per file and no join.
+    Partial writes are resumed; platforms without writev fall back to write_all per segment.
+    """
+    writev = getattr(os, "writev", None)
+    if writev is None:
+        for part in parts:
+            write_all(fd, part)
+        return
+    views = [memoryview(p) for p in parts if len(p)]
+    while views:
+        n = writev(fd, views)
+        while n:  # drop fully written segments, trim a partially written one
+            if n >= len(views[0]):
+                n -= len(views[0])
+                del views[0]
+            else:
+                views[0] = views[0][n:]
+                n = 0
+
+def copy_prefix(src_fd: int, dst_fd: int, count: int) -> bool:
+    """
+    Kernel-side copy of the first 'count' bytes of src into dst (reflinked on Btrfs/XFS).
+    Explicit offsets leave both file positions alone, so threads can share src_fd.
+    Returns False when copy_file_range is unavailable or fails; the caller writes instead.
+    """
+    copy = getattr(os, "copy_file_range", None)
+    if copy is None:
+        return False
+    done = 0
+    try:
+        while done < count:
+            n = copy(src_fd, dst_fd, count - done, done, done)
+            if n == 0:
+                return False
+            done += n
+    except OSError:
+        return False
+    return True
+
+WRITE_BATCH = 1024  # files handed to the writer pool per batch
+
+_job = {}
+
+def _init_worker() -> None:
+    """Pool initializer: forked workers inherit _prng's state, so reseed to keep pixels unique."""
+    _prng.seed(os.urandom(16))
+
+def _write_job(i_path) -> int:
+    # write_one is a closure over main()'s settings, inherited through fork (nothing pickled)
+    return _job["write_one"](i_path)
 
 def to_bytes(total: float, unit: str) -> int:
     u = unit.lower()
@@ -100,74 +144,115 @@ def main():
     ap.add_argument("--total-size", type=float, required=True)
     ap.add_argument("--unit", choices=["GB","GiB","MB"], default="GB")
     ap.add_argument("--png-width", type=int, default=512, help="PNG pixel width (>= 32 recommended)")
-    ap.add_argument("--mode", choices=["metadata","pixels","strong"], default="pixels",
-                    help="Uniqueness mode: metadata (bytes differ), pixels (row differs), strong (several rows differ)")
+    ap.add_argument("--mode", choices=["identical","metadata","pixels","strong"], default="pixels",
+                    help="Uniqueness mode: identical (one PNG for all), metadata (bytes differ), "
+                         "pixels (row differs), strong (several rows differ)")
     ap.add_argument("--rows-unique", type=int, default=8, help="For mode=strong, number of unique rows per image")
-    ap.add_argument("--jobs", type=int, default=1, help="Parallel writers (I/O bound)")
+    ap.add_argument("--jobs", type=int, default=None,
+                    help="Parallel writer threads (default: CPU count for identical/metadata, which only "
+                         "write; 1 for pixels/strong, where each thread holds a whole PNG in memory)")
+    ap.add_argument("--procs", type=int, default=1,
+                    help="Worker processes that each build and write PNGs, so pixel generation and "
+                         "IDAT emission run outside the GIL (POSIX fork only; overrides --jobs)")
     args = ap.parse_args()
 
     os.makedirs(args.outdir, exist_ok=True)
     if args.num_files < 1: raise SystemExit("num-files must be >= 1")
     if args.png_width < 32: raise SystemExit("png-width too small (>=32)")
+    if args.jobs is None:
+        args.jobs = (os.cpu_count() or 1) if args.mode in ("identical", "metadata") else 1
 
     total_bytes = to_bytes(args.total_size, args.unit)
     per_file_target = max(1, total_bytes // args.num_files)
 
     # Build a template based on the chosen uniqueness mode
-    if args.mode == "metadata":
+    # payload(i) returns the file as a list of segments (written in order, never joined).
+    # When shared_prefix > 0 the first segment is exactly that prefix, served from a template file.
+    shared_prefix = 0
+    if args.mode == "identical":
+        # Built once; every file is the same buffer, so the whole file comes from the template
+        height, period, base_png = pick_geometry_for_target(per_file_target, args.png_width, rows_in_period=1)
+        shared_prefix = len(base_png)
+        def payload(i: int) -> list:
+            return [base_png]
+    elif args.mode == "metadata":
         # One pixel pattern for all files, same height for all
         height, period, base_png = pick_geometry_for_target(per_file_target, args.png_width, rows_in_period=1)
         # Inject a fixed-length tEXt placeholder we will rewrite per file
         placeholder = fixed_len_text_chunk("Comment", b"X"*48, 48)
         base_png = insert_chunk_before_iend(base_png, placeholder)
         tex_len = len(placeholder)
-        def payload(i: int) -> bytes:
+        shared_prefix = len(base_png) - 12 - tex_len
+        prefix, iend = memoryview(base_png)[:shared_prefix], memoryview(base_png)[-12:]
+        def payload(i: int) -> list:
             token = f"FILE_{i:07d}_UNIQ_XXXXXXXXXXXXXXXXXXXX".encode("latin-1")
             token = token[:48] if len(token) >= 48 else token + b" "*(48-len(token))
             texc = fixed_len_text_chunk("Comment", token, 48)
-            return base_png[:-12 - tex_len] + texc + base_png[-12:]
+            return [prefix, texc, iend]
     elif args.mode == "pixels":
         # Each file gets its own unique row, same height/size
-        height, period, sample_png = pick_geometry_for_target(per_file_target, args.png_width, rows_in_period=1)
-        per_size = len(sample_png)
-        def payload(i: int) -> bytes:
-            row = secrets.token_bytes(3 * args.png_width)
-            png = build_png_from_rows(args.png_width, row, height)
-            # keep exact size by regenerating if needed (rare)
-            if len(png) != per_size:
-                return sample_png
-            return png
+        # Stored DEFLATE: the size depends on the geometry only, so no sample PNG or size check is needed
+        height, _ = choose_png_height_for_size(per_file_target, args.png_width)
+        def payload(i: int) -> list:
+            row = _prng.randbytes(3 * args.png_width)
+            return [build_png_from_rows(args.png_width, row, height)]
     else:  # strong
         rows_in_period = max(2, args.rows_unique)
-        height, period, sample_png = pick_geometry_for_target(per_file_target, args.png_width, rows_in_period)
-        per_size = len(sample_png)
-        def payload(i: int) -> bytes:
+        height = max(rows_in_period, choose_png_height_for_size(per_file_target, args.png_width)[0])
+        def payload(i: int) -> list:
             # build a fresh period with 'rows_in_period' unique rows
             row_len = 3 * args.png_width
-            p = b"".join(secrets.token_bytes(row_len) for _ in range(rows_in_period))
-            png = build_png_from_rows(args.png_width, p, height)
-            if len(png) != per_size:
-                return sample_png
-            return png
+            p = _prng.randbytes(rows_in_period * row_len)
+            return [build_png_from_rows(args.png_width, p, height)]
 
     # Prepare paths
     paths = [os.path.join(args.outdir, f"img_{i:05d}.png") for i in range(1, args.num_files + 1)]
 
+    # Files sharing a common prefix copy it from a template in the kernel and write only the tail
+    template_path = os.path.join(args.outdir, ".template.png")
+    template_fd = None
+    if shared_prefix:
+        with open(template_path, "wb") as f:
+            f.write(base_png[:shared_prefix])
+        template_fd = os.open(template_path, os.O_RDONLY)
+
     def write_one(i_path):
         i, path = i_path
-        data = payload(i)
-        with open(path, "wb", buffering=1024*1024) as f:
-            f.write(data)
-        return len(data)
+        parts = payload(i)
+        size = sum(map(len, parts))
+        # Unbuffered os-level I/O: segments go straight from their buffers in one writev, so no join
+        # and no BufferedWriter copy/flush; deliberately no fsync (generated data, crash safety is irrelevant)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+        try:
+            if template_fd is not None and copy_prefix(template_fd, fd, shared_prefix):
+                parts = parts[1:]
+                os.lseek(fd, shared_prefix, os.SEEK_SET)
+            _writev_all(fd, parts)
+        finally:
+            os.close(fd)
+        return size
 
     # Write files (optionally parallel)
-    if args.jobs > 1:
-        with ThreadPoolExecutor(max_workers=args.jobs) as ex:
-            sizes = list(ex.map(write_one, enumerate(paths, start=1)))
-    else:
-        sizes = []
-        for i, p in enumerate(paths, start=1):
-            sizes.append(write_one((i, p)))
+    try:
+        if args.procs > 1 and "fork" in multiprocessing.get_all_start_methods():
+            _job["write_one"] = write_one
+            with multiprocessing.get_context("fork").Pool(args.procs, initializer=_init_worker) as pool:
+                sizes = list(pool.imap(_write_job, enumerate(paths, start=1), chunksize=32))
+        elif args.jobs > 1:
+            # Submit in batches so at most WRITE_BATCH futures are pending at a time
+            sizes = []
+            jobs = list(enumerate(paths, start=1))
+            with ThreadPoolExecutor(max_workers=args.jobs) as ex:
+                for b in range(0, len(jobs), WRITE_BATCH):
+                    sizes.extend(ex.map(write_one, jobs[b:b + WRITE_BATCH]))
+        else:
+            sizes = []
+            for i, p in enumerate(paths, start=1):
+                sizes.append(write_one((i, p)))
+    finally:
+        if template_fd is not None:
+            os.close(template_fd)
+            os.remove(template_path)
 
     total_written = sum(sizes)
     print(f"Files: {args.num_files} | per-file ~{sizes[0]:,} bytes | total ~{total_written:,} bytes "
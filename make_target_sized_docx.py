@@ -11,6 +11,7 @@ You specify the target total size (GB/GiB) and the script computes the PNG size.
 Examples:
   python make_target_sized_docx.py --docx-path out.docx --num-images 2500 --target-size 3.9 --unit GB
   python make_target_sized_docx.py --docx-path out2.docx --num-images 1000 --target-size 2 --unit GB
+  python make_target_sized_docx.py --docx-path out3.docx --num-images 10000 --target-size 4 --unit GB --direct-zip
 
 Notes:
 - For very large N (e.g., 10k) Word 2016 may open slowly. If you only need size (not to view all),
@@ -18,101 +19,87 @@ Notes:
 """
 
 import argparse
-import io
 import os
-import random
-import struct
-import zlib
-from typing import Tuple
+import zipfile
 
 from docx import Document  # third-party
-from docx.shared import Cm  # for A4 + margins + width fit
+from docx.opc.constants import CONTENT_TYPE as CT, RELATIONSHIP_TYPE as RT
+from docx.opc.packuri import PackURI
+from docx.opc.phys_pkg import _ZipPkgWriter
+from docx.oxml.shape import CT_Inline
+from docx.parts.image import ImagePart
+from docx.shared import Cm, Emu  # for A4 + margins + width fit
 
-# ---------- PNG generator (valid 8-bit RGB, predictable size) ----------
-PNG_SIG = b"\x89PNG\r\n\x1a\n"
-
-
-def _crc32(data: bytes) -> int:
-    import binascii
-    return binascii.crc32(data) & 0xFFFFFFFF
+from _png_core import IEND_CHUNK, PNG_SIG, choose_png_height_for_size, make_ihdr, make_idat, random_raw
+from make_docx_all_visible_stdlib import MEDIA_COMPRESSION, XML_COMPRESSLEVEL, make_docx_all_visible
 
 
-def _chunk(typ: bytes, data: bytes) -> bytes:
-    return (struct.pack(">I", len(data)) + typ + data +
-            struct.pack(">I", _crc32(typ + data)))
+# ---------- ZIP container policy ----------
+def _part_writer(media_type: int):
+    """
+    _ZipPkgWriter.write to use while saving: python-docx deflates every part at the default
+    level, which only burns CPU on the random PNG media. Media gets media_type (level 1 if
+    compressed), XML/rels are deflated at XML_COMPRESSLEVEL.
+    """
+    def write(self, pack_uri, blob):
+        if pack_uri.membername.startswith("word/media/"):
+            self._zipf.writestr(pack_uri.membername, blob, compress_type=media_type, compresslevel=1)
+        else:
+            self._zipf.writestr(pack_uri.membername, blob, compress_type=zipfile.ZIP_DEFLATED,
+                                compresslevel=XML_COMPRESSLEVEL)
+    return write
 
 
-def build_png_bytes(width: int, height: int, seed: int) -> bytes:
+# ---------- PNG generator (valid 8-bit RGB, predictable size) ----------
+def build_png_bytes(width: int, height: int, seed: int) -> bytearray:
     """
-    Minimal 8-bit RGB PNG, filter type 0 per row, zlib level 0.
+    Minimal 8-bit RGB PNG, filter type 0 per row, stored (level 0) DEFLATE.
     Size ~= 8 (sig) + IHDR + IDAT(zlib hdr + raw) + IEND.
     Raw = height * (1 + 3*width), constant regardless of pixel randomness.
     """
-    rng = random.Random(seed)
-    # IHDR
-    ihdr = struct.pack(">IIBBBBB",
-                       width, height,
-                       8,  # bit depth
-                       2,  # color type (truecolor RGB)
-                       0, 0, 0)
-    # Raw data: for each row: 1 filter byte (0) + 3*width bytes of RGB
-    row_len = 1 + 3 * width
-    raw = bytearray(row_len * height)
-    p = 0
-    for _ in range(height):
-        raw[p] = 0  # filter 0
-        p += 1
-        for _ in range(width * 3):
-            raw[p] = rng.randrange(0, 256)
-            p += 1
-    # zlib compress with level 0 (stored blocks): predictable size ~ raw + small overhead
-    idat = zlib.compress(bytes(raw), level=0)
-    png = bytearray()
-    png += PNG_SIG
-    png += _chunk(b'IHDR', ihdr)
-    png += _chunk(b'IDAT', idat)
-    png += _chunk(b'IEND', b'')
-    return bytes(png)
-
-
-def choose_png_geometry_for_size(per_image_target: int, width: int = 512) -> Tuple[int, bytes]:
-    """
-    Given a desired per-image size (bytes), compute a height that yields >= target.
-    We keep width fixed (512) and increase height until we reach the target.
-    Returns (height, png_bytes).
-    """
-    base_overhead = 100  # cushion
-    row_bytes = 1 + 3 * width
-    height = max(1, (per_image_target - base_overhead) // row_bytes)
-    seed = 1234
-    png = build_png_bytes(width, height, seed)
-    attempts = 0
-    while len(png) < per_image_target and attempts < 20000:
-        height += 1
-        seed += 1
-        png = build_png_bytes(width, height, seed)
-        attempts += 1
-    return height, png
+    # Raw data: for each row: 1 filter byte (0) + 3*width bytes of RGB, one C-level fill
+    raw = random_raw(width, height, seed)
+    # Stored DEFLATE blocks emitted directly (no compressor): predictable size ~ raw + small overhead
+    # IHDR (8-bit truecolor RGB) is cached per geometry and IEND is a constant: no per-image CRCs
+    return make_idat(raw, PNG_SIG + make_ihdr(width, height), IEND_CHUNK)
 
 
 # ---------- DOCX builder ----------
-def make_docx(docx_path: str, num_images: int, target_total_bytes: int) -> dict:
+def make_docx(docx_path: str, num_images: int, target_total_bytes: int, direct_zip: bool = False,
+              compression: str = "stored") -> dict:
     """
     Create one .docx with num_images PNGs displayed, scaled to A4 text width.
     Compute per-image target size from total target; generate one geometry and reuse it
     (using different seeds so pixels differ while the size stays identical).
+    direct_zip=True skips python-docx and streams the package with zipfile instead
+    (make_docx_all_visible_stdlib): no in-memory document tree, memory stays flat for large N.
+    compression is the ZIP method for the PNG media (a MEDIA_COMPRESSION key).
     """
     if num_images < 1:
         raise ValueError("num_images must be >= 1")
+    if compression not in MEDIA_COMPRESSION:
+        raise ValueError(f"compression must be one of {', '.join(MEDIA_COMPRESSION)}")
+
+    if direct_zip:
+        info = make_docx_all_visible(docx_path, num_images, target_total_bytes, png_width_px=512, unique=True,
+                                     compression=compression)
+        return {
+            "docx_path": info["docx_path"],
+            "png_width": info["png_px"][0],
+            "png_height": info["png_px"][1],
+            "per_png_bytes": info["per_png_bytes"],
+            "target_bytes": target_total_bytes,
+            "final_bytes": info["final_bytes"],
+        }
 
     # Reserve a small overhead for XML/ZIP central directory (~ a few hundred KB).
     overhead_cushion = 600_000
     target_for_images = max(1, target_total_bytes - overhead_cushion)
     per_image_target = max(1, target_for_images // num_images)
 
-    # Find a PNG geometry (constant) that meets per-image target
-    height, sample_png = choose_png_geometry_for_size(per_image_target, width=512)
-    per_png_bytes = len(sample_png)
+    # Find a PNG geometry (constant) that meets per-image target; width fixed at 512 px.
+    # The size depends on the geometry only, so no sample PNG is built.
+    height, per_png_bytes = choose_png_height_for_size(per_image_target, 512)
 
     # === Build the Word doc ===
     doc = Document()
@@ -134,21 +121,34 @@ def make_docx(docx_path: str, num_images: int, target_total_bytes: int) -> dict:
     )
 
     # Insert all images visible, scaled to content width
-    # Reuse geometry; vary seed to make different pixels while keeping size identical
+    # Reuse geometry; vary seed to make different pixels while keeping size identical.
+    # Image parts and inline drawings are injected directly: doc.add_picture would re-sniff
+    # every blob, scan all image parts by SHA1 and all relationships for a match/free rId, and
+    # rescan the document for the next shape id, i.e. O(N) work per picture. Each image still
+    # gets its own part, so the size holds.
+    # Scaled to content width, keeping the aspect ratio (what Image.scaled_dimensions computes)
+    cx = Cm(content_width_cm)
+    cy = Emu(round(cx * height / 512))
+    shape_id = doc.part.next_id
     seed = 10000
     for i in range(1, num_images + 1):
-        png_bytes = build_png_bytes(512, height, seed)
+        png_bytes = build_png_bytes(512, height, seed)  # same geometry => exactly per_png_bytes
         seed += 1
-        # sanity: enforce identical size (for determinism)
-        if len(png_bytes) != per_png_bytes:
-            # extremely unlikely with fixed geometry and level=0; but if it happens, adjust
-            png_bytes = sample_png
-        stream = io.BytesIO(png_bytes)
-        doc.add_picture(stream, width=Cm(content_width_cm))
+        filename = f"image{i}.png"
+        image_part = ImagePart(PackURI(f"/word/media/{filename}"), CT.PNG, png_bytes)
+        rId = f"rIdImg{i}"  # own prefix: never collides with the template's rIdN, no scan for a free id
+        doc.part.rels.add_relationship(RT.IMAGE, image_part, rId)
+        inline = CT_Inline.new_pic_inline(shape_id, rId, filename, cx, cy)
+        shape_id += 1
+        doc.add_paragraph().add_run()._r.add_drawing(inline)
         # optional caption/paragraph separator
         # doc.add_paragraph(f"Image {i}")
 
-    doc.save(docx_path)
+    default_write, _ZipPkgWriter.write = _ZipPkgWriter.write, _part_writer(MEDIA_COMPRESSION[compression])
+    try:
+        doc.save(docx_path)
+    finally:
+        _ZipPkgWriter.write = default_write
 
     final_size = os.path.getsize(docx_path)
     return {
@@ -180,10 +180,15 @@ def main():
     ap.add_argument("--num-images", type=int, required=True, help="How many PNGs to embed & display")
     ap.add_argument("--target-size", type=float, required=True, help="Target size value")
     ap.add_argument("--unit", choices=["GB", "GiB"], default="GB", help="Unit for target size")
+    ap.add_argument("--direct-zip", action="store_true",
+                    help="Write the package directly with zipfile instead of python-docx (fast for large N)")
+    ap.add_argument("--compression", choices=list(MEDIA_COMPRESSION), default="stored",
+                    help="ZIP method for PNG media (default: stored; random pixels do not compress)")
     args = ap.parse_args()
 
     target_bytes = to_bytes(args.target_size, args.unit)
-    info = make_docx(args.docx_path, args.num_images, target_bytes)
+    info = make_docx(args.docx_path, args.num_images, target_bytes, direct_zip=args.direct_zip,
+                     compression=args.compression)
 
     fb = info["final_bytes"]
     print(f"Created: {info['docx_path']}")